@@ -0,0 +1,243 @@
+from utils import coords_to_pos, BOARD_SIZE
+from board import Board
+from game import Game
+from pieces import King, GoldGeneral, SilverGeneral, Bishop, Rook, Pawn
+import argparse
+import time
+
+INFINITY = 1000000
+MATE_SCORE = 100000
+MATE_THRESHOLD = MATE_SCORE - 1000
+
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+PIECE_VALUES = {King: 0, GoldGeneral: 60, SilverGeneral: 50, Bishop: 80, Rook: 100, Pawn: 10}
+PROMOTED_VALUES = {SilverGeneral: 60, Bishop: 120, Rook: 140, Pawn: 60}
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Analyzer:
+    """
+    Multi-PV alpha-beta search over Board positions.
+
+    Generated children and transposition entries are kept between calls
+    and keyed by Zobrist hash, so deeper iterations and alternative lines
+    reuse the work of earlier ones.
+    """
+
+    def __init__(self, max_cached_boards=50000):
+        self.max_cached_boards = max_cached_boards
+        self.num_cached_boards = 0
+        self.children = {}
+        self.transpositions = {}
+        self.deadline = None
+
+    def get_children(self, board):
+        """
+        Returns [(command, child, is_capture)] for every legal command of the current player.
+
+        Commands use the same text as game input, e.g. "move a1 b2 promote" or "drop p c3".
+        """
+        if board.zobrist_hash in self.children:
+            return self.children[board.zobrist_hash]
+
+        if self.num_cached_boards > self.max_cached_boards:
+            self.children = {}
+            self.num_cached_boards = 0
+
+        player = board.current_player
+        children = []
+
+        for piece in player.pieces:
+            for dst in board.get_valid_dsts(piece):
+                is_capture = bool(board.get_piece(dst))
+                command = "move " + coords_to_pos(piece.coords) + " " + coords_to_pos(dst)
+                can_promote = board.can_promote(piece, piece.coords, dst)
+
+                options = [True] if type(piece) == Pawn and can_promote else \
+                    [False, True] if can_promote else [False]
+                for promote in options:
+                    child = board.try_move_piece(piece, dst)
+                    if promote:
+                        child.promote_piece(child.get_piece(dst))
+                    children.append((command + " promote" if promote and type(piece) != Pawn else command,
+                                     child, is_capture))
+
+        dropped = set()
+        for piece in player.captures:
+            if piece.icon in dropped:
+                continue
+            dropped.add(piece.icon)
+
+            for i in range(BOARD_SIZE):
+                for j in range(BOARD_SIZE):
+                    dst = (i, j)
+                    if board.get_piece(dst) or (type(piece) == Pawn and not board.can_drop_pawn(player, piece, dst)):
+                        continue
+                    child = board.try_drop_piece(player, piece, dst)
+                    children.append(("drop " + piece.icon.lower() + " " + coords_to_pos(dst), child, False))
+
+        legal_children = []
+        for command, child, is_capture in children:
+            if not child.is_checked(child.current_player):
+                child.switch_current_player()
+                legal_children.append((command, child, is_capture))
+
+        self.children[board.zobrist_hash] = legal_children
+        self.num_cached_boards += len(legal_children)
+        return legal_children
+
+    def evaluate(self, board):
+        """ Returns the material balance from the current player's point of view.
+        """
+        score = 0
+        for name in board.players:
+            player = board.players[name]
+            material = sum(PROMOTED_VALUES[type(p)] if p.is_promoted else PIECE_VALUES[type(p)]
+                           for p in player.pieces)
+            material += sum(PIECE_VALUES[type(p)] for p in player.captures)
+            score += material if player is board.current_player else -material
+        return score
+
+    def order_children(self, board, children):
+        """ Puts the transposition table's best command first, then captures.
+        """
+        entry = self.transpositions.get(board.zobrist_hash)
+        best_command = entry[3] if entry else None
+        return sorted(children, key=lambda c: (c[0] != best_command, not c[2]))
+
+    def search(self, board, depth, alpha, beta, ply):
+        """ Returns the negamax score of board searched to depth within (alpha, beta).
+        """
+        if self.deadline and time.monotonic() > self.deadline:
+            raise SearchTimeout()
+
+        entry = self.transpositions.get(board.zobrist_hash)
+        if entry and entry[0] >= depth:
+            score = from_table_score(entry[1], ply)
+            if entry[2] == EXACT or (entry[2] == LOWER_BOUND and score >= beta) or \
+                    (entry[2] == UPPER_BOUND and score <= alpha):
+                return score
+
+        if depth == 0:
+            return self.evaluate(board)
+
+        children = self.get_children(board)
+        if not children:
+            return -MATE_SCORE + ply
+
+        original_alpha = alpha
+        best_score, best_command = -INFINITY, None
+        for command, child, _ in self.order_children(board, children):
+            score = -self.search(child, depth - 1, -beta, -alpha, ply + 1)
+            if score > best_score:
+                best_score, best_command = score, command
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        flag = UPPER_BOUND if best_score <= original_alpha else LOWER_BOUND if best_score >= beta else EXACT
+        self.transpositions[board.zobrist_hash] = (depth, to_table_score(best_score, ply), flag, best_command)
+        return best_score
+
+    def get_pv(self, board, depth):
+        """ Follows best commands stored in the transposition table from board.
+        """
+        pv = []
+        for _ in range(depth):
+            entry = self.transpositions.get(board.zobrist_hash)
+            if not entry or not entry[3]:
+                break
+            children = {command: child for command, child, _ in self.get_children(board)}
+            if entry[3] not in children:
+                break
+            pv.append(entry[3])
+            board = children[entry[3]]
+        return pv
+
+    def analyze(self, board, num_lines=3, max_depth=3, time_limit=None):
+        """
+        Yields the best num_lines candidate commands after each completed depth.
+
+        Every result is a dict with the depth and a list of lines, each with
+        the command, its score in centipawn-like units for the player to
+        move, and the principal variation. Stop iterating at any time to
+        end the analysis; with a time_limit the search stops on its own
+        after the last depth that finished in time.
+        """
+        self.deadline = time.monotonic() + time_limit if time_limit else None
+        root_children = self.get_children(board)
+        previous_scores = {}
+
+        for depth in range(1, max_depth + 1):
+            ordered = sorted(root_children, key=lambda c: -previous_scores.get(c[0], -INFINITY))
+            lines = []
+
+            try:
+                for command, child, _ in ordered:
+                    kth_best = lines[num_lines - 1]["score"] if len(lines) >= num_lines else -INFINITY
+                    score = -self.search(child, depth - 1, -INFINITY, -kth_best, 1)
+                    previous_scores[command] = score
+
+                    if score > kth_best:
+                        pv = [command] + self.get_pv(child, depth - 1)
+                        lines.append({"move": command, "score": score, "pv": pv})
+                        lines.sort(key=lambda line: -line["score"])
+                        del lines[num_lines:]
+            except SearchTimeout:
+                return
+
+            yield {"depth": depth, "lines": lines}
+
+
+def to_table_score(score, ply):
+    """ Stores mate scores relative to the node rather than the root.
+    """
+    if score > MATE_THRESHOLD:
+        return score + ply
+    if score < -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def from_table_score(score, ply):
+    if score > MATE_THRESHOLD:
+        return score - ply
+    if score < -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+def analyze(board, num_lines=3, max_depth=3, time_limit=None):
+    """ Yields top candidate commands for board as the search deepens. See Analyzer.analyze.
+    """
+    return Analyzer().analyze(board, num_lines, max_depth, time_limit)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--file", dest="filename", help="analyzes the final position of a game file.")
+    parser.add_argument("-k", "--lines", type=int, default=3, help="number of candidate moves to show.")
+    parser.add_argument("-d", "--depth", type=int, default=3, help="maximum search depth in plies.")
+    parser.add_argument("-t", "--time", type=float, help="time limit in seconds.")
+    args = parser.parse_args()
+
+    if args.filename:
+        game = Game(args.filename)
+        for command in game.file_commands:
+            if not game.execute_input(command):
+                break
+            game.board.switch_current_player()
+        board = game.board
+    else:
+        board = Board()
+
+    for result in analyze(board, args.lines, args.depth, args.time):
+        print(f"depth {result['depth']}")
+        for line in result["lines"]:
+            print(f"  {line['score']:>7}  {' '.join(line['pv'])}")
@@ -0,0 +1,349 @@
+from utils import parse_test_case, is_valid_command, input_to_commands, input_to_coords, input_to_drop
+from utils import coords_to_pos, pos_to_coords, BOARD_SIZE
+from board import Board
+from game import Game
+import argparse
+import struct
+import sys
+import zlib
+
+MAGIC = b"PSGA"
+INDEX_MAGIC = b"PSGI"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+INDEX_ENTRY = struct.Struct("<QIII")
+FOOTER = struct.Struct("<QII4s")
+
+GAMES_PER_BLOCK = 256
+STANDARD_START = 1
+
+PIECE_CODES = "kgsbrp"
+DROP_CODES = "gsbrp"
+NUM_SQUARES = BOARD_SIZE * BOARD_SIZE
+MOVE_FLAG = 0x8000
+
+
+def encode_varint(n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def decode_varint(data, pos):
+    """ Returns (value, next position).
+    """
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def square_code(pos):
+    coords = pos_to_coords(pos)
+    return coords[0] * BOARD_SIZE + coords[1]
+
+
+def code_square(code):
+    return coords_to_pos((code // BOARD_SIZE, code % BOARD_SIZE))
+
+
+def encode_icon(icon):
+    """ Packs a piece icon such as "p", "+R" or "K" into one byte.
+    """
+    letter = icon.strip("+")
+    return PIECE_CODES.index(letter.lower()) | ("+" in icon) << 3 | letter.isupper() << 4
+
+
+def decode_icon(code):
+    icon = PIECE_CODES[code & 0x7]
+    if code & 0x10:
+        icon = icon.upper()
+    return "+" + icon if code & 0x8 else icon
+
+
+def encode_command(command):
+    """
+    Packs a move or drop command into 1 or 2 bytes.
+
+    A drop is one byte below 0x80: piece * 25 + square. A move is two
+    bytes with the top bit set: (src * 25 + dst) * 2 + promote.
+    """
+    if not is_valid_command(command):
+        raise ValueError(f"Cannot encode command {command!r}.")
+
+    name, promote = input_to_commands(command)
+    if name == "drop":
+        icon, dst = input_to_drop(command)
+        if icon.lower() not in DROP_CODES:
+            raise ValueError(f"Cannot encode command {command!r}.")
+        return bytes([DROP_CODES.index(icon.lower()) * NUM_SQUARES + dst[0] * BOARD_SIZE + dst[1]])
+
+    src, dst = input_to_coords(command)
+    code = MOVE_FLAG | ((src[0] * BOARD_SIZE + src[1]) * NUM_SQUARES + dst[0] * BOARD_SIZE + dst[1]) * 2 + promote
+    return struct.pack(">H", code)
+
+
+def init_command_tables():
+    """ Returns the command strings for every drop code and every move code.
+    """
+    drops = ["drop " + DROP_CODES[piece] + " " + code_square(dst)
+             for piece in range(len(DROP_CODES)) for dst in range(NUM_SQUARES)]
+    moves = []
+    for src in range(NUM_SQUARES):
+        for dst in range(NUM_SQUARES):
+            command = "move " + code_square(src) + " " + code_square(dst)
+            moves += [command, command + " promote"]
+    return drops, moves
+
+
+def decode_commands(data, pos, num_commands):
+    """ Returns (commands, next position) for num_commands packed commands.
+    """
+    commands = []
+    for _ in range(num_commands):
+        byte = data[pos]
+        if byte & 0x80:
+            commands.append(MOVE_COMMANDS[((byte & 0x7f) << 8) | data[pos + 1]])
+            pos += 2
+        else:
+            commands.append(DROP_COMMANDS[byte])
+            pos += 1
+    return commands, pos
+
+
+def get_standard_pieces():
+    board = Board()
+    return sorted((piece.icon, coords_to_pos(piece.coords))
+                  for name in board.players for piece in board.players[name].pieces)
+
+
+def encode_game(board_metadata):
+    """ Packs a dict in the format of parse_test_case into bytes.
+    """
+    pieces = sorted((d["piece"], d["position"]) for d in board_metadata["initialPieces"])
+    is_standard = (pieces == STANDARD_PIECES and not board_metadata["upperCaptures"]
+                   and not board_metadata["lowerCaptures"])
+
+    out = bytearray([STANDARD_START if is_standard else 0])
+    if not is_standard:
+        out += encode_varint(len(pieces))
+        for icon, position in pieces:
+            out += bytes([encode_icon(icon), square_code(position)])
+        for key in ["upperCaptures", "lowerCaptures"]:
+            out += encode_varint(len(board_metadata[key]))
+            out += bytes(encode_icon(icon) for icon in board_metadata[key])
+
+    out += encode_varint(len(board_metadata["moves"]))
+    for command in board_metadata["moves"]:
+        out += encode_command(command)
+    return bytes(out)
+
+
+def decode_game(data, pos):
+    """ Returns (board_metadata, next position) for the game packed at pos.
+    """
+    flags = data[pos]
+    pos += 1
+    board_metadata = dict(initialPieces=[], upperCaptures=[], lowerCaptures=[])
+
+    if flags & STANDARD_START:
+        board_metadata["initialPieces"] = [dict(piece=icon, position=position) for icon, position in STANDARD_PIECES]
+    else:
+        num_pieces, pos = decode_varint(data, pos)
+        for _ in range(num_pieces):
+            board_metadata["initialPieces"].append(dict(piece=decode_icon(data[pos]), position=code_square(data[pos + 1])))
+            pos += 2
+        for key in ["upperCaptures", "lowerCaptures"]:
+            num_captures, pos = decode_varint(data, pos)
+            board_metadata[key] = [decode_icon(code) for code in data[pos:pos + num_captures]]
+            pos += num_captures
+
+    num_commands, pos = decode_varint(data, pos)
+    board_metadata["moves"], pos = decode_commands(data, pos, num_commands)
+    return board_metadata, pos
+
+
+class ArchiveWriter:
+    """
+    Writes games into blocks of packed records, each block zlib-compressed.
+
+    The file is a header, the blocks, an index with the offset, size, first
+    game and game count of every block, and a fixed-size footer pointing
+    at the index.
+    """
+
+    def __init__(self, filename, games_per_block=GAMES_PER_BLOCK):
+        self.file = open(filename, "wb")
+        self.games_per_block = games_per_block
+        self.block = bytearray()
+        self.block_games = 0
+        self.num_games = 0
+        self.index = []
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0))
+
+    def add_game(self, board_metadata):
+        self.block += encode_game(board_metadata)
+        self.block_games += 1
+        self.num_games += 1
+        if self.block_games >= self.games_per_block:
+            self.flush_block()
+
+    def flush_block(self):
+        if not self.block_games:
+            return
+        compressed = zlib.compress(bytes(self.block))
+        self.index.append((self.file.tell(), len(compressed), self.num_games - self.block_games, self.block_games))
+        self.file.write(compressed)
+        self.block = bytearray()
+        self.block_games = 0
+
+    def close(self):
+        self.flush_block()
+        index_offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(FOOTER.pack(index_offset, len(self.index), self.num_games, INDEX_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ArchiveReader:
+    """
+    Reads games from an archive, either streaming in order or by game number.
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        magic, version, _ = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{filename} is not a version {VERSION} game archive.")
+
+        self.file.seek(-FOOTER.size, 2)
+        index_offset, num_blocks, self.num_games, index_magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if index_magic != INDEX_MAGIC:
+            raise ValueError(f"{filename} has no block index.")
+
+        self.file.seek(index_offset)
+        self.index = [INDEX_ENTRY.unpack(self.file.read(INDEX_ENTRY.size)) for _ in range(num_blocks)]
+
+    def __len__(self):
+        return self.num_games
+
+    def read_block(self, block_number):
+        offset, length, _, _ = self.index[block_number]
+        self.file.seek(offset)
+        return zlib.decompress(self.file.read(length))
+
+    def iter_block(self, block_number):
+        data = self.read_block(block_number)
+        pos = 0
+        for _ in range(self.index[block_number][3]):
+            board_metadata, pos = decode_game(data, pos)
+            yield board_metadata
+
+    def __iter__(self):
+        """ Yields every game, decompressing one block at a time.
+        """
+        for block_number in range(len(self.index)):
+            yield from self.iter_block(block_number)
+
+    def get_game(self, game_number):
+        """ Returns the game with the given number, decoding only its block.
+        """
+        if not 0 <= game_number < self.num_games:
+            raise IndexError(f"Game {game_number} is not in the archive.")
+
+        low, high = 0, len(self.index) - 1
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.index[mid][2] <= game_number:
+                low = mid
+            else:
+                high = mid - 1
+
+        for i, board_metadata in enumerate(self.iter_block(low)):
+            if i == game_number - self.index[low][2]:
+                return board_metadata
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def replay(board_metadata):
+    """
+    Replays a game onto a Board, yielding (command, board) after every legal command.
+
+    Stops at the first illegal command or when the game ends by repetition.
+    The same Board object is updated in place.
+    """
+    game = Game(board_metadata=board_metadata)
+    for command in game.file_commands:
+        if game.game_over or not game.execute_input(command):
+            return
+        game.end_turn()
+        yield command, game.board
+
+
+def format_test_case(board_metadata):
+    """ Returns the game in the text format read by parse_test_case.
+    """
+    lines = [d["piece"] + " " + d["position"] for d in board_metadata["initialPieces"]]
+    lines += ["", "[" + " ".join(board_metadata["upperCaptures"]) + "]",
+              "[" + " ".join(board_metadata["lowerCaptures"]) + "]", ""]
+    lines += board_metadata["moves"]
+    return "\n".join(lines) + "\n"
+
+
+STANDARD_PIECES = get_standard_pieces()
+DROP_COMMANDS, MOVE_COMMANDS = init_command_tables()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = subparsers.add_parser("pack", help="packs game files into an archive.")
+    pack_parser.add_argument("archive")
+    pack_parser.add_argument("files", nargs="+")
+
+    extract_parser = subparsers.add_parser("extract", help="prints one game in file-mode format.")
+    extract_parser.add_argument("archive")
+    extract_parser.add_argument("game_number", type=int)
+
+    count_parser = subparsers.add_parser("count", help="prints the number of games in an archive.")
+    count_parser.add_argument("archive")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        with ArchiveWriter(args.archive) as writer:
+            for filename in args.files:
+                try:
+                    writer.add_game(parse_test_case(filename))
+                except ValueError as e:
+                    print(f"Skipping {filename}: {e}", file=sys.stderr)
+
+    elif args.command == "extract":
+        with ArchiveReader(args.archive) as reader:
+            sys.stdout.write(format_test_case(reader.get_game(args.game_number)))
+
+    else:
+        with ArchiveReader(args.archive) as reader:
+            print(len(reader))
@@ -0,0 +1,341 @@
+from utils import coords_to_pos, input_to_coords, BOARD_SIZE
+from board import Board
+from game import Game
+from pieces import Piece
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+
+SEED = 5555
+NUM_GAMES = 20
+MAX_PLIES = 60
+REPEAT = 5
+PROCESSES = 3
+BATCH = 8
+DEFAULT_THRESHOLD = 0.10
+CONFIRM_RUNS = 2
+
+
+def get_candidate_commands(board):
+    """ Returns every move and drop command the current player could try, legal or not.
+    """
+    commands = []
+    player = board.current_player
+
+    for piece in player.pieces:
+        for dst in board.get_valid_dsts(piece):
+            command = "move " + coords_to_pos(piece.coords) + " " + coords_to_pos(dst)
+            commands.append(command)
+            if board.can_promote(piece, piece.coords, dst):
+                commands.append(command + " promote")
+
+    for icon in sorted(set(piece.icon.lower() for piece in player.captures)):
+        for i in range(BOARD_SIZE):
+            for j in range(BOARD_SIZE):
+                if not board.get_piece((i, j)):
+                    commands.append("drop " + icon + " " + coords_to_pos((i, j)))
+
+    return commands
+
+
+def leaves_king_in_check(board, command):
+    """ Returns whether command would leave the mover's own king attacked.
+    """
+    if not command.startswith("move"):
+        return False
+    src, dst = input_to_coords(command)
+    board_copy = board.try_move_piece(board.get_piece(src), dst)
+    return board_copy.is_checked(board_copy.current_player)
+
+
+def play_random_game(rand, max_plies):
+    """ Returns the commands of a game of random legal commands from the initial position.
+    """
+    game = Game()
+    commands = []
+
+    while len(commands) < max_plies and not game.board.is_checkmated(game.board.current_player):
+        candidates = get_candidate_commands(game.board)
+        rand.shuffle(candidates)
+
+        for command in candidates:
+            if not leaves_king_in_check(game.board, command) and game.execute_input(command):
+                game.board.switch_current_player()
+                game.board.current_player.num_moves += 1
+                commands.append(command)
+                break
+        else:
+            break
+
+    return commands
+
+
+def generate_workload(seed=SEED, num_games=NUM_GAMES, max_plies=MAX_PLIES):
+    """
+    Returns the command lists of num_games seeded random games.
+
+    The games depend on the engine that plays them, so a baseline stores
+    them rather than its seed: every later run replays the same commands.
+    """
+    rand = random.Random(seed)
+    return [play_random_game(rand, max_plies) for _ in range(num_games)]
+
+
+def replay_positions(games):
+    """ Returns a copy of the board before every command of every game.
+    """
+    positions = []
+    for commands in games:
+        game = Game()
+        for command in commands:
+            positions.append(game.board.copy())
+            if not game.execute_input(command):
+                break
+            game.board.switch_current_player()
+            game.board.current_player.num_moves += 1
+    return positions
+
+
+def hash_workload(games, positions):
+    """
+    Returns an md5 of the commands and of every replayed position.
+
+    Any engine change that makes the stored games replay differently
+    changes the hash.
+    """
+    digest = hashlib.md5()
+    for commands in games:
+        digest.update(("\n".join(commands) + "\n\n").encode())
+    for board in positions:
+        captures = [" ".join(sorted(p.icon for p in board.players[name].captures)) for name in board.players]
+        digest.update((str(board) + "|".join(captures) + board.current_player.name).encode())
+    return digest.hexdigest()
+
+
+def write_game_file(path, commands):
+    """ Writes commands in the file-mode format, starting from the initial position.
+    """
+    board = Board()
+    with open(path, "w") as f:
+        for name in ["lower", "UPPER"]:
+            for piece in board.players[name].pieces:
+                f.write(piece.icon + " " + coords_to_pos(piece.coords) + "\n")
+        f.write("\n[]\n[]\n\n")
+        for command in commands:
+            f.write(command + "\n")
+
+
+def measure(func, ops, repeat):
+    """
+    Returns repeat samples of the time func takes per op, where one call performs ops operations.
+
+    Each sample runs func enough times to take at least 0.2 s (see
+    timeit.Timer.autorange).
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return [t / (number * ops) for t in timer.repeat(repeat=repeat, number=number)]
+
+
+def summarize(samples):
+    """
+    Returns the fastest sample and the spread of samples.
+
+    The spread, the relative gap between the median and the fastest sample,
+    estimates how much timings move between runs of identical code.
+    """
+    samples = sorted(samples)
+    return {"seconds_per_op": samples[0], "spread": samples[len(samples) // 2] / samples[0] - 1}
+
+
+def call_batched(calls):
+    """ Calls each (func, args) BATCH times in an unrolled loop, so cheap calls outweigh loop overhead.
+    """
+    for func, args in calls:
+        func(*args)
+        func(*args)
+        func(*args)
+        func(*args)
+        func(*args)
+        func(*args)
+        func(*args)
+        func(*args)
+
+
+def get_drop_cases(positions):
+    """
+    Returns (all, checking) pawn drop cases as (board, pawn, dst).
+
+    Each position gets a pawn added to the current player's captures. The
+    checking cases drop right in front of the opposing king on a file
+    without a pawn, so they reach the drop-pawn mate test.
+    """
+    drop_cases = []
+    checking_cases = []
+    for b in positions:
+        board_copy = b.copy()
+        player = board_copy.current_player
+        pawn = Piece.from_icon("p" if player.name == "lower" else "P")
+        board_copy.add_capture(player, pawn)
+
+        for i in range(BOARD_SIZE):
+            for j in range(BOARD_SIZE):
+                if not board_copy.get_piece((i, j)):
+                    drop_cases.append((board_copy, pawn, (i, j)))
+
+        king = board_copy.get_other_player(player).king
+        dst = (king.coords[0], king.coords[1] - 1 if player.name == "lower" else king.coords[1] + 1)
+        last_row = BOARD_SIZE - 1 if player.name == "lower" else 0
+        if board_copy.in_bounds(dst) and dst[1] != last_row and not board_copy.get_piece(dst) and \
+                not player.pawn_files & (1 << dst[0]):
+            checking_cases.append((board_copy, pawn, dst))
+
+    return drop_cases, checking_cases
+
+
+def get_benchmarks(games, tmpdir):
+    """
+    Returns {benchmark name: (func, ops)} over the positions of the given games.
+
+    Game files for the replay benchmark are written to tmpdir.
+    """
+    positions = replay_positions(games)
+
+    checked = [b for b in positions if b.is_checked(b.current_player)]
+    unchecked = [b for b in positions if not b.is_checked(b.current_player)]
+    pieces = [(b, piece) for b in positions for name in b.players for piece in b.players[name].pieces]
+    drop_cases, checking_cases = get_drop_cases(positions)
+
+    benchmarks = {}
+
+    benchmarks["board_copy"] = (lambda: [b.copy() for b in positions], len(positions))
+
+    benchmarks["get_valid_dsts"] = (lambda: [b.get_valid_dsts(piece) for b, piece in pieces], len(pieces))
+
+    def update_heatmaps():
+        for b, piece in pieces:
+            b.update_heatmap(piece, 1)
+            b.update_heatmap(piece, -1)
+    benchmarks["update_heatmap"] = (update_heatmaps, 2 * len(pieces))
+
+    unchecked_calls = [(b.is_checkmated, (b.current_player,)) for b in unchecked]
+    benchmarks["is_checkmated_unchecked"] = (lambda: call_batched(unchecked_calls), BATCH * len(unchecked_calls))
+
+    if checked:
+        benchmarks["is_checkmated_checked"] = (lambda: [b.is_checkmated(b.current_player) for b in checked],
+                                               len(checked))
+
+    drop_calls = [(b.can_drop_pawn, (b.current_player, pawn, dst)) for b, pawn, dst in drop_cases]
+    benchmarks["can_drop_pawn"] = (lambda: call_batched(drop_calls), BATCH * len(drop_calls))
+
+    if checking_cases:
+        benchmarks["can_drop_pawn_checking"] = (
+            lambda: [b.can_drop_pawn(b.current_player, pawn, dst) for b, pawn, dst in checking_cases],
+            len(checking_cases))
+
+    filenames = []
+    for i, commands in enumerate(games):
+        filenames.append(os.path.join(tmpdir, f"game_{i}.in"))
+        write_game_file(filenames[-1], commands)
+    benchmarks["file_replay_per_ply"] = (lambda: [Game(filename, io.StringIO()).play() for filename in filenames],
+                                         sum(len(commands) for commands in games))
+
+    return benchmarks
+
+
+def run_worker(games, names=None, repeat=REPEAT):
+    """ Returns {benchmark name: samples} for the named benchmarks, or all of them.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        benchmarks = get_benchmarks(games, tmpdir)
+        return {name: measure(func, ops, repeat) for name, (func, ops) in benchmarks.items()
+                if names is None or name in names}
+
+
+def run_benchmarks(games, names=None, processes=PROCESSES):
+    """
+    Returns {benchmark name: measurement}, pooling samples from several fresh processes.
+
+    Timings shift between interpreter processes as well as within one,
+    so each worker is a new process and they run one after another.
+    """
+    context = multiprocessing.get_context("spawn")
+    samples = {}
+    for _ in range(processes):
+        with context.Pool(1) as pool:
+            for name, worker_samples in pool.apply(run_worker, (games, names)).items():
+                samples.setdefault(name, []).extend(worker_samples)
+    return {name: summarize(name_samples) for name, name_samples in samples.items()}
+
+
+def find_regressions(results, baseline, threshold):
+    """ Returns (name, baseline, current) for every benchmark slower than baseline by more than threshold.
+    """
+    regressions = []
+    for name, current in results.items():
+        if name in baseline and current["seconds_per_op"] > baseline[name]["seconds_per_op"] * (1 + threshold):
+            regressions.append((name, baseline[name]["seconds_per_op"], current["seconds_per_op"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", default="bench_results.json", help="file to record results to.")
+    parser.add_argument("-b", "--baseline", help="results file to compare against; its stored games are replayed.")
+    parser.add_argument("--save-baseline", action="store_true", help="also write results to the baseline file.")
+    parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="smallest slowdown flagged as a regression (default 0.10).")
+    parser.add_argument("--seed", type=int, default=SEED, help="seed for generating new games.")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        games = baseline["workload"]
+    else:
+        games = generate_workload(args.seed)
+
+    workload_hash = hash_workload(games, replay_positions(games))
+    if baseline and workload_hash != baseline["workload_hash"]:
+        print("The baseline's games replay to different positions with this engine; "
+              "results are not comparable. Save a new baseline.")
+        sys.exit(2)
+
+    results = run_benchmarks(games)
+
+    # A suspected regression is measured again, keeping the faster run,
+    # so a burst of load on the machine is not reported as one.
+    for _ in range(CONFIRM_RUNS if baseline else 0):
+        suspects = [name for name, _, _ in find_regressions(results, baseline["results"], args.threshold)]
+        if not suspects:
+            break
+        for name, result in run_benchmarks(games, suspects).items():
+            results[name] = min(results[name], result, key=lambda r: r["seconds_per_op"])
+
+    record = {"seed": baseline["seed"] if baseline else args.seed, "python": platform.python_version(),
+              "workload_hash": workload_hash, "results": results, "workload": games}
+
+    with open(args.output, "w") as f:
+        json.dump(record, f, indent=2)
+
+    for name, result in results.items():
+        print(f"{name:<26}{result['seconds_per_op'] * 1e6:>12.2f} us/op  (spread {result['spread'] * 100:.1f}%)")
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(record, f, indent=2)
+
+    elif baseline:
+        regressions = find_regressions(results, baseline["results"], args.threshold)
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: {old * 1e6:.2f} -> {new * 1e6:.2f} us/op (+{(new / old - 1) * 100:.0f}%)")
+        sys.exit(1 if regressions else 0)
@@ -1,8 +1,29 @@
-from utils import input_to_coords, input_to_commands, stringify_board
+from utils import input_to_coords, input_to_commands, stringify_row, stringify_footer
 from utils import add_coords, coords_to_pos, pos_to_coords, input_to_drop, NUM_PAWNS
 from utils import parse_test_case, get_moves_from_dict, get_drops_from_dict, BOARD_SIZE
 from pieces import Piece, King, GoldGeneral, SilverGeneral, Bishop, Rook, Pawn
 import copy
+import random
+
+REPETITION_LIMIT = 4
+ZOBRIST_SEED = 5555
+
+
+def init_zobrist_keys():
+    """ Returns random 64-bit keys for every (icon, square), (icon, hand count) and side to move.
+    """
+    rand = random.Random(ZOBRIST_SEED)
+    max_in_hand = 2 * (len(Board.PIECE_TYPES) + NUM_PAWNS)
+    icons = []
+    for icon in "KGSBRP":
+        for player_icon in [icon, icon.lower()]:
+            icons += [player_icon, "+" + player_icon]
+
+    square_keys = {(icon, (i, j)): rand.getrandbits(64)
+                   for icon in icons for i in range(BOARD_SIZE) for j in range(BOARD_SIZE)}
+    hand_keys = {(icon, n): rand.getrandbits(64) for icon in icons for n in range(max_in_hand)}
+
+    return square_keys, hand_keys, rand.getrandbits(64)
 
 
 class Player:
@@ -15,6 +36,8 @@ class Player:
         self.pieces = []
         self.captures = []
         self.num_moves = 0
+        self.check_streak = 0
+        self.pawn_files = 0
 
     def copy(self, piece_to_copy):
         """ Returns a (deep) copy of the player.
@@ -24,6 +47,8 @@ class Player:
         new_player.king = piece_to_copy[self.king]
         new_player.pieces = [piece_to_copy[p] for p in self.pieces]
         new_player.captures = [piece_to_copy[cp] for cp in self.captures]
+        new_player.check_streak = self.check_streak
+        new_player.pawn_files = self.pawn_files
 
         return new_player
 
@@ -37,14 +62,32 @@ class Board:
         self.blockable_pieces = []
         self.players = {"lower" : Player("lower"), "UPPER": Player("UPPER")}
         self.current_player = self.players["lower"]
+        self.zobrist_hash = 0
+        self.ply = 0
+        self.position_counts = {}
+        self.position_first_ply = {}
+        self.row_cache = [None]*BOARD_SIZE
 
         if init:
             self.init_grid()
+            self.record_position()
     
     @staticmethod
     def from_file(filename):
+        return Board.from_metadata(parse_test_case(filename))
+
+    @staticmethod
+    def from_metadata(board_metadata):
+        """ Returns a board and its commands from a dict in the format of parse_test_case.
+
+        Raises ValueError unless each player has exactly one king.
+        """
         board = Board(init=False)
-        file_commands = board.init_grid_filemode(filename)
+        file_commands = board.init_grid_metadata(board_metadata)
+        for name in board.players:
+            if sum(1 for piece in board.players[name].pieces if type(piece) == King) != 1:
+                raise ValueError(f"{name} player must have exactly one king.")
+        board.record_position()
         return board, file_commands
 
     def init_grid(self):
@@ -68,15 +111,20 @@ class Board:
     def init_grid_filemode(self, filename):
         """ Initializes grid from file config as opposed to default config.
         """
-        board_metadata = parse_test_case(filename)
+        return self.init_grid_metadata(parse_test_case(filename))
 
+    def init_grid_metadata(self, board_metadata):
+        """ Initializes grid from parsed file config (see parse_test_case).
+        """
         for piece_dict in board_metadata["initialPieces"]:
             icon, coords = piece_dict["piece"], pos_to_coords(piece_dict["position"])
             piece = Piece.from_icon(icon, coords)
             self.place_piece(piece.player_name, piece, coords)
 
-        self.players["UPPER"].captures = [Piece.from_icon(i) for i in board_metadata["upperCaptures"]]
-        self.players["lower"].captures = [Piece.from_icon(i) for i in board_metadata["lowerCaptures"]]
+        for name, key in [("UPPER", "upperCaptures"), ("lower", "lowerCaptures")]:
+            for icon in board_metadata[key]:
+                self.add_capture(self.players[name], Piece.from_icon(icon))
+
         file_commands = board_metadata["moves"]
 
         return file_commands
@@ -95,6 +143,8 @@ class Board:
         new_board.players = self.copy_players(piece_to_copy)
         new_board.blockable_pieces = [piece_to_copy[bp] for bp in self.blockable_pieces]
         new_board.current_player = new_board.players[self.current_player.name]
+        new_board.zobrist_hash = self.zobrist_hash
+        new_board.ply = self.ply
 
         return new_board
 
@@ -124,8 +174,9 @@ class Board:
         """ Returns a copy of the board after specified drop command.
         """
         board_copy = self.copy()
-        piece_copy = self.get_copy_from_captures(piece, self.current_player.captures)
-        board_copy.drop_piece(board_copy.players[player.name], piece_copy, dst)
+        player_copy = board_copy.players[player.name]
+        piece_copy = self.get_copy_from_captures(piece, player_copy.captures)
+        board_copy.drop_piece(player_copy, piece_copy, dst)
 
         return board_copy
 
@@ -164,11 +215,29 @@ class Board:
 
         return valid_dsts
 
+    def is_blocked_dst(self, piece, dst):
+        """ Returns whether dst lies on one of the piece's sliding paths behind another piece.
+        """
+        player = self.players[piece.player_name]
+
+        for moves_set in piece.blockable_moves_sets:
+            blocked = False
+            for move in moves_set:
+                possible_dst = add_coords(player, move, piece.coords)
+                if possible_dst == dst:
+                    return blocked
+                if self.in_bounds(possible_dst) and self.get_piece(possible_dst):
+                    blocked = True
+
+        return False
+
     def is_valid_dst(self, piece, dst, count_own_pieces):
         other_player_name = self.get_other_player_name(piece.player_name)
         
         if self.in_bounds(dst):
-            if not self.is_players_piece(piece.player_name, dst) or count_own_pieces:
+            if count_own_pieces:
+                return True
+            if not self.is_players_piece(piece.player_name, dst):
                 if type(piece) != King or self.get_heatmap_val(other_player_name, dst) == 0:
                     return True
         
@@ -200,6 +269,8 @@ class Board:
             self.update_heatmap(blockable_piece, -1)
 
         self.grid[coords[0]][coords[1]] = piece
+        self.row_cache[coords[1]] = None
+        self.zobrist_hash ^= ZOBRIST_SQUARE_KEYS[(piece.icon, coords)]
         self.update_heatmap(piece, 1)
 
         for blockable_piece in self.blockable_pieces:
@@ -212,6 +283,9 @@ class Board:
 
         player.pieces.append(piece)
 
+        if type(piece) == Pawn:
+            player.pawn_files |= 1 << coords[0]
+
         if piece.blockable:
             self.blockable_pieces.append(piece)
 
@@ -248,11 +322,18 @@ class Board:
 
         self.update_heatmap(piece, -1)
         self.grid[piece.coords[0]][piece.coords[1]] = ""
+        self.row_cache[piece.coords[1]] = None
+        self.zobrist_hash ^= ZOBRIST_SQUARE_KEYS[(piece.icon, piece.coords)]
 
         for blockable_piece in self.blockable_pieces:
             self.update_heatmap(blockable_piece, 1)
 
-        self.players[piece.player_name].pieces.remove(piece)
+        player = self.players[piece.player_name]
+        player.pieces.remove(piece)
+
+        if type(piece) == Pawn and not any(type(p) == Pawn and p.player_name == piece.player_name
+                                           for p in self.grid[piece.coords[0]]):
+            player.pawn_files &= ~(1 << piece.coords[0])
 
     def capture_piece(self, piece):
         """ adds captured piece to the list of the current player
@@ -261,7 +342,32 @@ class Board:
         capture_player = self.players[self.get_other_player_name(piece.player_name)]
         piece.demote()
         piece.player_name = capture_player.name
-        capture_player.captures.append(piece)
+        self.add_capture(capture_player, piece)
+
+    def add_capture(self, player, piece):
+        """ Adds piece to the player's captures, keeping the position hash in sync.
+        """
+        count = sum(1 for cp in player.captures if cp.icon == piece.icon)
+        self.zobrist_hash ^= ZOBRIST_HAND_KEYS[(piece.icon, count)]
+        player.captures.append(piece)
+
+    def remove_capture(self, player, piece):
+        """ Removes piece from the player's captures, keeping the position hash in sync.
+        """
+        player.captures.remove(piece)
+        count = sum(1 for cp in player.captures if cp.icon == piece.icon)
+        self.zobrist_hash ^= ZOBRIST_HAND_KEYS[(piece.icon, count)]
+
+    def promote_piece(self, piece):
+        """ Promotes a piece on the board, keeping the heatmap and position hash in sync.
+        """
+        self.update_heatmap(piece, -1)
+        self.zobrist_hash ^= ZOBRIST_SQUARE_KEYS[(piece.icon, piece.coords)]
+        promoted = piece.promote()
+        self.zobrist_hash ^= ZOBRIST_SQUARE_KEYS[(piece.icon, piece.coords)]
+        self.update_heatmap(piece, 1)
+        self.row_cache[piece.coords[1]] = None
+        return promoted
 
     def drop_piece(self, player, piece, dst):
         """ Drops captured piece onto the board. Removes piece from captured pieces.
@@ -269,8 +375,6 @@ class Board:
         if self.get_piece(dst):
             return False
 
-        captured_pieces = player.captures
-
         if not piece:
             return False
 
@@ -278,28 +382,54 @@ class Board:
             return False
 
         self.place_piece(self.current_player.name, piece, dst)
-        captured_pieces.remove(piece)
+        self.remove_capture(player, piece)
         return True
     
     def can_drop_pawn(self, player, piece, dst):
+        """ 
+        Returns whether player may drop a pawn on dst.
+
+        Cheapest checks first: the last row, the pawn-per-file bitmask, and
+        whether the pawn gives check at all. Only a checking drop needs the
+        (copy-free) drop-pawn mate test.
+        """
         if self.can_promote(piece, piece.coords, dst):
             return False
 
-        board_copy = self.copy()
-        captures_copy = board_copy.current_player.captures
-        piece_copy = self.get_copy_from_captures(piece, captures_copy)
+        if player.pawn_files & (1 << dst[0]):
+            return False
 
-        board_copy.place_piece(piece.player_name, piece_copy, dst)
-        captures_copy.remove(piece_copy)
+        other_player = self.get_other_player(player)
+        if not other_player.king or \
+                add_coords(player, Pawn.unblockable_moves[0], dst) != other_player.king.coords:
+            return True
 
-        other_player = board_copy.get_other_player(player)
-        if board_copy.is_checkmated(other_player, False):
-            return False
+        return not self.is_pawn_drop_mate(player, dst)
+
+    def is_pawn_drop_mate(self, player, dst):
+        """ 
+        Returns whether a checking pawn dropped by player on dst would be mate.
+
+        The board is left untouched: the defending king needs a square that
+        is safe with the pawn in place, or another piece must be able to
+        take the pawn without exposing the king.
+        """
+        other_player = self.get_other_player(player)
+        king = other_player.king
+
+        for move in king.unblockable_moves:
+            escape = add_coords(other_player, move, king.coords)
+            if not self.in_bounds(escape) or self.is_players_piece(other_player.name, escape):
+                continue
+            if not self.is_attacked_by(player, escape, king.coords, None if escape == dst else dst):
+                return False
 
-        for p in player.pieces:
-            if type(p) == Pawn and dst[0] == p.coords[0]:
+        for piece in other_player.pieces:
+            if piece == king or dst not in self.get_valid_dsts(piece):
+                continue
+            if not self.is_attacked_by(player, king.coords, piece.coords, dst):
                 return False
-        
+
         return True
     
     def get_copy_from_captures(self, piece, captures):
@@ -334,6 +464,28 @@ class Board:
 
         return other_heatmap[king_coords[0]][king_coords[1]] > 0
     
+    def is_attacked_by(self, player, coords, vacated=None, occupied=None):
+        """ 
+        Returns whether any of the player's pieces reaches coords, treating
+        the vacated square as empty and the occupied square as filled.
+        """
+        for piece in player.pieces:
+            for move in piece.unblockable_moves:
+                if add_coords(player, move, piece.coords) == coords:
+                    return True
+
+            for moves_set in piece.blockable_moves_sets:
+                for move in moves_set:
+                    possible_dst = add_coords(player, move, piece.coords)
+                    if possible_dst == coords:
+                        return True
+                    if not self.in_bounds(possible_dst) or possible_dst == occupied:
+                        break
+                    if possible_dst != vacated and self.get_piece(possible_dst):
+                        break
+
+        return False
+
     def is_checkmated(self, player, check_drops=True):
         """ Returns whether or not player is checkmated.
         """
@@ -387,6 +539,58 @@ class Board:
             self.current_player = self.players["lower"]
         else:
             self.current_player = self.players["UPPER"]
+        self.zobrist_hash ^= ZOBRIST_SIDE_KEY
+
+    def record_position(self):
+        """ 
+        Records the current position in the repetition history.
+
+        Called once per completed move (after switching players). The
+        previous mover's check streak counts how many of their consecutive
+        moves gave check, which is what decides perpetual check.
+        """
+        if self.ply > 0:
+            mover = self.get_other_player(self.current_player)
+            if self.is_checked(self.current_player):
+                mover.check_streak += 1
+            else:
+                mover.check_streak = 0
+
+        position = self.zobrist_hash
+        self.position_counts[position] = self.position_counts.get(position, 0) + 1
+        if position not in self.position_first_ply:
+            self.position_first_ply[position] = self.ply
+        self.ply += 1
+
+    def is_repetition(self):
+        """ Returns whether the current position has occurred REPETITION_LIMIT times (sennichite).
+        """
+        return self.position_counts.get(self.zobrist_hash, 0) >= REPETITION_LIMIT
+
+    def get_perpetual_checker(self):
+        """ 
+        Returns the name of the player who gave check with every one of their
+        moves since the repeated position first occurred, or None.
+        """
+        moves_per_player = (self.ply - 1 - self.position_first_ply[self.zobrist_hash]) // 2
+        for name in self.players:
+            if moves_per_player and self.players[name].check_streak >= moves_per_player:
+                return name
+        return None
     
     def __str__(self):
-        return stringify_board(self.grid)
\ No newline at end of file
+        """ 
+        Renders the board, re-rendering only rows changed since the last call.
+
+        Any change to a square goes through place_piece, remove_piece or
+        promote_piece, which clear the cached string for that row.
+        """
+        for row in range(BOARD_SIZE):
+            if self.row_cache[row] is None:
+                self.row_cache[row] = stringify_row(self.grid, row)
+
+        return "".join(reversed(self.row_cache)) + BOARD_FOOTER
+
+
+ZOBRIST_SQUARE_KEYS, ZOBRIST_HAND_KEYS, ZOBRIST_SIDE_KEY = init_zobrist_keys()
+BOARD_FOOTER = stringify_footer(BOARD_SIZE)
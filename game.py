@@ -1,20 +1,29 @@
-from utils import input_to_coords, input_to_commands, stringify_board
+from utils import input_to_coords, input_to_commands
 from utils import add_coords, coords_to_pos, pos_to_coords, input_to_drop
-from utils import parse_test_case, get_moves_from_dict, get_drops_from_dict
+from utils import parse_test_case, get_moves_from_dict, get_drops_from_dict, is_valid_command
 from board import Board, Player
 from pieces import Piece, King, GoldGeneral, SilverGeneral, Bishop, Rook, Pawn
 import copy
 import argparse
+import json
 import sys
 
+OUTPUT_BUFFER_SIZE = 1 << 16
+MAX_MOVES = 200
+
 
 class Game:
 
-    def __init__(self, filename=None):
-        if filename:
+    def __init__(self, filename=None, out=None, board_metadata=None):
+        self.filename = filename
+        self.out = out if out else sys.stdout
+        if filename and not board_metadata:
+            board_metadata = parse_test_case(filename)
+
+        if board_metadata:
             self.file_index = 0
             self.is_filemode = True
-            self.board, self.file_commands = Board.from_file(args.filename[0])
+            self.board, self.file_commands = Board.from_metadata(board_metadata)
         else:
             self.is_filemode = False
             self.board = Board()
@@ -34,8 +43,7 @@ class Game:
 
             user_input = self.get_input()
             if self.execute_input(user_input):
-                self.board.switch_current_player()
-                self.board.current_player.num_moves += 1
+                self.end_turn()
  
             elif not self.file_over:
                 self.board.switch_current_player()
@@ -45,10 +53,112 @@ class Game:
         
         self.display_game_over()
 
+    def validate(self):
+        """ 
+        Replays the file commands without printing, stopping at the first illegal move.
+
+        Returns a dict with the file, whether every move was legal, the ply
+        reached, and for an illegal move the move string and the reason. A
+        move that leaves the mover's own king attacked is illegal even when
+        the mover was not in check. A command after the game has ended (by
+        checkmate, the move limit, repetition or perpetual check) is reported
+        as illegal too; end_reason says how the game ended.
+        """
+        result = {"file": self.filename, "valid": True, "ply": 0, "move": "", "reason": "",
+                  "commands": len(self.file_commands), "end_reason": ""}
+
+        while not self.game_over:
+            user_input = self.next_file_command()
+            if self.file_over:
+                break
+
+            result["ply"] = self.file_index
+            if not is_valid_command(user_input):
+                reason = "malformed-command"
+            elif self.execute_input(user_input):
+                if self.board.is_checked(self.board.current_player):
+                    reason = "leaves-king-in-check"
+                else:
+                    self.end_turn()
+                    if not self.game_over:
+                        self.check_game_end()
+                    continue
+            else:
+                reason = self.get_illegal_reason(user_input)
+
+            result.update(valid=False, move=user_input, reason=reason)
+            break
+
+        if self.game_over and result["valid"] and self.file_index < len(self.file_commands):
+            result.update(valid=False, ply=self.file_index + 1, move=self.file_commands[self.file_index],
+                          reason="move-after-game-over")
+        result["end_reason"] = self.winner_reason
+        return result
+
+    def get_illegal_reason(self, user_input):
+        """ Returns why a rejected move or drop command is illegal in the current position.
+        """
+        command, promote = input_to_commands(user_input)
+        current_player = self.board.current_player
+
+        if command == "move":
+            src, dst = input_to_coords(user_input)
+            piece = self.board.get_piece(src)
+
+            if not piece:
+                return "no-piece"
+            if piece.player_name != current_player.name:
+                return "not-your-piece"
+
+            if dst not in self.board.get_valid_dsts(piece):
+                if self.board.is_players_piece(current_player.name, dst):
+                    return "own-piece-at-destination"
+                if type(piece) == King and \
+                        dst in [add_coords(current_player, m, src) for m in piece.unblockable_moves]:
+                    return "leaves-king-in-check"
+                if self.board.is_blocked_dst(piece, dst):
+                    return "blocked-path"
+                return "unreachable-destination"
+
+            if self.board.is_checked(current_player):
+                board_copy = self.board.try_move_piece(piece, dst)
+                if board_copy.is_checked(board_copy.current_player):
+                    return "leaves-king-in-check"
+
+            if promote and not self.board.can_promote(piece, piece.coords, dst):
+                return "bad-promotion"
+
+        elif command == "drop":
+            icon, dst = input_to_drop(user_input)
+            found_piece = None
+            for piece in current_player.captures:
+                if piece.icon.lower() == icon.lower():
+                    found_piece = piece
+                    break
+
+            if not found_piece:
+                return "piece-not-in-hand"
+            if self.board.get_piece(dst):
+                return "occupied-square"
+
+            if self.board.is_checked(current_player):
+                board_copy = self.board.try_drop_piece(current_player, found_piece, dst)
+                if board_copy.is_checked(board_copy.current_player):
+                    return "leaves-king-in-check"
+
+            if type(found_piece) == Pawn and not self.board.can_drop_pawn(current_player, found_piece, dst):
+                return "illegal-pawn-drop"
+
+        else:
+            return "malformed-command"
+
+        return "illegal-move"
+
     def get_input(self):
         if self.is_filemode:
             return self.next_file_command()
         else:
+            self.out.flush()
             return input()
 
     def next_file_command(self):
@@ -88,11 +198,11 @@ class Game:
 
         if promote and self.board.can_promote(piece, piece.coords, dst):
             if self.board.move_piece(piece, dst):
-                return piece.promote()
+                return self.board.promote_piece(piece)
 
         elif type(piece) == Pawn and self.board.can_promote(piece, piece.coords, dst):
             if self.board.move_piece(piece, dst):
-                return piece.promote()
+                return self.board.promote_piece(piece)
 
         elif not promote:
             return self.board.move_piece(piece, dst)
@@ -115,67 +225,124 @@ class Game:
                 return False
 
         return self.board.drop_piece(current_player, found_piece, dst)
+
+    def end_turn(self):
+        """ Hands the turn to the other player after a legal command and checks for repetition.
+        """
+        self.board.switch_current_player()
+        self.board.current_player.num_moves += 1
+        self.board.record_position()
+        self.check_repetition()
+
+    def check_repetition(self):
+        """ Ends the game on four-fold repetition: a tie, or a loss for a perpetual checker.
+        """
+        if not self.board.is_repetition():
+            return
+
+        checker = self.board.get_perpetual_checker()
+        if checker:
+            self.winner = self.board.get_other_player_name(checker)
+            self.winner_reason = "Perpetual check."
+        else:
+            self.winner_reason = "Four-fold repetition."
+        self.game_over = True
+
+    def check_game_end(self):
+        """ Ends the game when the current player is checkmated or the move limit is reached.
+        """
+        if self.board.is_checkmated(self.board.current_player):
+            self.winner = self.board.get_other_player_name(self.board.current_player.name)
+            self.winner_reason = "Checkmate."
+            self.game_over = True
+
+        if not self.game_over and self.board.current_player.num_moves >= MAX_MOVES:
+            self.winner_reason = "Too many moves."
+            self.game_over = True
     
     def print_state(self):
         """ Prints the state of the board along with metadata at current game iteration.
         """
         print(self.board.get_other_player_name(self.board.current_player.name) + 
-              " player action: " + self.last_command.strip()) 
-        print(self.board)
+              " player action: " + self.last_command.strip(), file=self.out) 
+        print(self.board, file=self.out)
         self.print_metadata()
     
     def print_metadata(self):
         print("Captures UPPER: " + 
-              " ".join([piece.icon for piece in self.board.players["UPPER"].captures]))
+              " ".join([piece.icon for piece in self.board.players["UPPER"].captures]), file=self.out)
         print("Captures lower: " + 
-              " ".join([piece.icon for piece in self.board.players["lower"].captures]))
-        print()
+              " ".join([piece.icon for piece in self.board.players["lower"].captures]), file=self.out)
+        print(file=self.out)
         
-        if self.board.is_checkmated(self.board.current_player):
-            self.winner = self.board.get_other_player_name(self.board.current_player.name)
-            self.winner_reason = "Checkmate."
-            self.game_over = True
-
-        if not self.game_over and self.board.current_player.num_moves > 199:
-            print("Tie game.  Too many moves.")
-            self.game_over = True
+        self.check_game_end()
 
         if not self.game_over and self.board.is_checked(self.board.current_player):
-            print(f"{self.board.current_player.name} player is in check!")
+            print(f"{self.board.current_player.name} player is in check!", file=self.out)
             self.print_available_moves()
 
         if not self.game_over:
-            print(self.board.current_player.name + "> ", end="")
+            print(self.board.current_player.name + "> ", end="", file=self.out)
     
     def print_available_moves(self):
         """ Prints available moves to get out of check.
         """
-        print("Available moves:")
+        print("Available moves:", file=self.out)
 
         moves = get_moves_from_dict(self.board.get_uncheck_moves(self.board.current_player))
         drops = get_drops_from_dict(self.board.get_uncheck_drops(self.board.current_player))
 
         for drop in sorted(drops):
-            print(drop)
+            print(drop, file=self.out)
         
         for move in sorted(moves):
-            print(move)
+            print(move, file=self.out)
     
     def display_game_over(self):
         self.print_state()
         if self.game_over and self.winner and self.winner_reason:
-            print(self.winner + " player wins.  " + self.winner_reason)
+            print(self.winner + " player wins.  " + self.winner_reason, file=self.out)
+        elif self.game_over and self.winner_reason:
+            print("Tie game.  " + self.winner_reason, file=self.out)
         
 
+def validate_files(filenames):
+    """ Validates game files, writing one JSON result per line. Returns whether all were valid.
+    """
+    all_valid = True
+    for filename in filenames:
+        try:
+            result = Game(filename).validate()
+        except (OSError, ValueError, KeyError, IndexError):
+            result = {"file": filename, "valid": False, "ply": 0, "move": "", "reason": "malformed-file",
+                      "commands": 0, "end_reason": ""}
+
+        all_valid = all_valid and result["valid"]
+        sys.stdout.write(json.dumps(result) + "\n")
+
+    return all_valid
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-f", "--file", nargs="*", dest="filename", help="runs MiniShogi in file mode.")
     parser.add_argument("-i", "--interactive", action="store_true", help="runs MiniShogi in interactive mode.")
+    parser.add_argument("--validate", nargs="+", metavar="FILE", 
+                        help="checks game files for illegal moves and prints JSON results.")
     args = parser.parse_args()
 
     if len(sys.argv) == 1:
         parser.print_help()
         sys.exit(0)
 
-    game = Game(args.filename)
-    game.play()
\ No newline at end of file
+    if args.validate:
+        sys.exit(0 if validate_files(args.validate) else 1)
+
+    if not args.filename:
+        Game().play()
+        sys.exit(0)
+
+    out = open(sys.stdout.fileno(), "w", buffering=OUTPUT_BUFFER_SIZE, closefd=False)
+    for filename in args.filename:
+        Game(filename, out).play()
+    out.flush()
\ No newline at end of file
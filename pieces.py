@@ -48,6 +48,9 @@ class Piece:
         piece_type = type(self)
         new_piece = piece_type(self.player_name, self.coords, True)
         new_piece.id = self.id
+        new_piece.is_promoted = self.is_promoted
+        new_piece.unblockable_moves = self.unblockable_moves
+        new_piece.blockable_moves_sets = self.blockable_moves_sets
         return new_piece
 
     def demote(self):
@@ -0,0 +1,447 @@
+from utils import BOARD_SIZE, add_coords
+from board import Player
+from pieces import Piece, King
+from array import array
+from collections import deque
+import argparse
+import struct
+import zlib
+
+MAGIC = b"PSTB"
+VERSION = 1
+
+PLAYER_NAMES = ["lower", "UPPER"]
+PIECE_LETTERS = "GSBRP"
+PROMOTABLE_LETTERS = "SBRP"
+
+NUM_SQUARES = BOARD_SIZE * BOARD_SIZE
+HAND = NUM_SQUARES
+NUM_LOCATIONS = NUM_SQUARES + 1
+NUM_PIECE_STATES = NUM_LOCATIONS * 2 * 2
+
+DRAW = 0
+INVALID = 255
+MAX_DISTANCE = 253
+
+
+def coords_to_square(coords):
+    return coords[0] * BOARD_SIZE + coords[1]
+
+
+def square_to_coords(square):
+    return (square // BOARD_SIZE, square % BOARD_SIZE)
+
+
+def init_move_tables():
+    """
+    Returns reachable squares for every (letter, promoted, owner, square).
+
+    Each entry is a pair (steps, rays): steps are single-step destinations
+    and rays are lists of sliding destinations ordered outwards, taken from
+    the move sets of the pieces module.
+    """
+    tables = {}
+    for letter in "K" + PIECE_LETTERS:
+        for promoted in (0, 1):
+            if promoted and letter not in PROMOTABLE_LETTERS:
+                continue
+            piece = Piece.from_icon(("+" if promoted else "") + letter)
+
+            for owner, name in enumerate(PLAYER_NAMES):
+                player = Player(name)
+                for square in range(NUM_SQUARES):
+                    coords = square_to_coords(square)
+                    steps = [add_coords(player, move, coords) for move in piece.unblockable_moves]
+                    rays = [[add_coords(player, move, coords) for move in moves_set]
+                            for moves_set in piece.blockable_moves_sets]
+
+                    steps = [coords_to_square(d) for d in steps if in_bounds(d)]
+                    rays = [[coords_to_square(d) for d in ray if in_bounds(d)] for ray in rays]
+                    tables[(letter, promoted, owner, square)] = (steps, [ray for ray in rays if ray])
+    return tables
+
+
+def in_bounds(coords):
+    return 0 <= coords[0] < BOARD_SIZE and 0 <= coords[1] < BOARD_SIZE
+
+
+def is_promotion_row(owner, square):
+    row = square % BOARD_SIZE
+    return row == BOARD_SIZE - 1 if owner == 0 else row == 0
+
+
+class Position:
+    """
+    Lightweight position used for retrograde analysis.
+
+    kings holds the king square for each owner (0 = lower, 1 = UPPER) and
+    pieces holds one [owner, promoted, location] list per non-king piece,
+    in the same order as the material letters. A location of HAND means
+    the piece is among its owner's captures.
+    """
+
+    def __init__(self, material, stm, kings, pieces):
+        self.material = material
+        self.stm = stm
+        self.kings = kings
+        self.pieces = pieces
+
+    def occupancy(self):
+        occupied = {self.kings[0]: 0, self.kings[1]: 1}
+        for owner, promoted, location in self.pieces:
+            if location != HAND:
+                occupied[location] = owner
+        return occupied
+
+    def is_attacked(self, square, owner, occupied):
+        """ Returns whether square is attacked by any piece belonging to owner.
+        """
+        attackers = [("K", 0, self.kings[owner])]
+        attackers += [(self.material[i], promoted, location)
+                      for i, (piece_owner, promoted, location) in enumerate(self.pieces)
+                      if piece_owner == owner and location != HAND]
+
+        for letter, promoted, location in attackers:
+            steps, rays = MOVE_TABLES[(letter, promoted, owner, location)]
+            if square in steps:
+                return True
+            for ray in rays:
+                for dst in ray:
+                    if dst == square:
+                        return True
+                    if dst in occupied:
+                        break
+        return False
+
+    def is_checked(self, owner, occupied=None):
+        if occupied is None:
+            occupied = self.occupancy()
+        return self.is_attacked(self.kings[owner], 1 - owner, occupied)
+
+    def is_valid(self):
+        """ Returns whether the position can occur in a game with the side to move on turn.
+        """
+        if self.kings[0] == self.kings[1]:
+            return False
+
+        squares = set(self.kings)
+        for i, (owner, promoted, location) in enumerate(self.pieces):
+            letter = self.material[i]
+            if location == HAND:
+                if promoted:
+                    return False
+                continue
+            if location in squares or (promoted and letter not in PROMOTABLE_LETTERS):
+                return False
+            if letter == "P" and not promoted and is_promotion_row(owner, location):
+                return False
+            squares.add(location)
+
+        return not self.is_checked(1 - self.stm)
+
+    def successors(self, check_pawn_mate=True):
+        """ Returns every legal position reachable by the side to move.
+        """
+        stm = self.stm
+        occupied = self.occupancy()
+        children = []
+
+        def add_child(kings, pieces):
+            child = Position(self.material, 1 - stm, kings, pieces)
+            if not child.is_checked(stm):
+                children.append(child)
+
+        def move_to(dst):
+            """ Returns the piece list after capturing whatever stands on dst.
+            """
+            pieces = [list(p) for p in self.pieces]
+            for p in pieces:
+                if p[2] == dst:
+                    p[0], p[1], p[2] = stm, 0, HAND
+            return pieces
+
+        steps, _ = MOVE_TABLES[("K", 0, stm, self.kings[stm])]
+        for dst in steps:
+            if occupied.get(dst) == stm or dst == self.kings[1 - stm]:
+                continue
+            kings = list(self.kings)
+            kings[stm] = dst
+            add_child(kings, move_to(dst))
+
+        for i, (owner, promoted, location) in enumerate(self.pieces):
+            if owner != stm or location == HAND:
+                continue
+            letter = self.material[i]
+            steps, rays = MOVE_TABLES[(letter, promoted, owner, location)]
+
+            dsts = [dst for dst in steps if occupied.get(dst) != stm]
+            for ray in rays:
+                for dst in ray:
+                    if occupied.get(dst) != stm:
+                        dsts.append(dst)
+                    if dst in occupied:
+                        break
+
+            for dst in dsts:
+                if dst == self.kings[1 - stm]:
+                    continue
+                can_promote = (not promoted and letter in PROMOTABLE_LETTERS and
+                               (is_promotion_row(stm, dst) or is_promotion_row(stm, location)))
+                options = [1] if letter == "P" and can_promote else [0, 1] if can_promote else [promoted]
+
+                for new_promoted in options:
+                    pieces = move_to(dst)
+                    pieces[i] = [stm, new_promoted, dst]
+                    add_child(list(self.kings), pieces)
+
+        dropped = set()
+        for i, (owner, promoted, location) in enumerate(self.pieces):
+            letter = self.material[i]
+            if owner != stm or location != HAND or letter in dropped:
+                continue
+            dropped.add(letter)
+
+            for dst in range(NUM_SQUARES):
+                if dst in occupied:
+                    continue
+                if letter == "P" and not self.can_drop_pawn(dst, check_pawn_mate):
+                    continue
+                pieces = [list(p) for p in self.pieces]
+                pieces[i] = [stm, 0, dst]
+                add_child(list(self.kings), pieces)
+
+        return children
+
+    def can_drop_pawn(self, dst, check_pawn_mate):
+        """ Applies the board's pawn drop rules: no last row, one pawn per file, no pawn-drop mate.
+        """
+        stm = self.stm
+        if is_promotion_row(stm, dst):
+            return False
+
+        for i, (owner, promoted, location) in enumerate(self.pieces):
+            if self.material[i] == "P" and owner == stm and location != HAND and \
+                    location // BOARD_SIZE == dst // BOARD_SIZE:
+                return False
+
+        if not check_pawn_mate:
+            return True
+
+        steps, _ = MOVE_TABLES[("P", 0, stm, dst)]
+        if self.kings[1 - stm] not in steps:
+            return True
+
+        pieces = [list(p) for p in self.pieces]
+        for i, p in enumerate(pieces):
+            if p[0] == stm and p[2] == HAND and self.material[i] == "P":
+                p[2] = dst
+                break
+        child = Position(self.material, 1 - stm, list(self.kings), pieces)
+        return bool(child.successors(False))
+
+
+class TablebaseGenerator:
+    """
+    Solves every position of one material signature by retrograde analysis.
+
+    A material signature is the string of non-king piece letters, e.g. "R"
+    or "GP"; each piece may be on the board for either player or in either
+    player's captures. A side with no legal moves has lost.
+    """
+
+    def __init__(self, material):
+        self.material = "".join(sorted(material.upper()))
+        self.size = 2 * NUM_SQUARES * NUM_SQUARES * NUM_PIECE_STATES ** len(self.material)
+
+    def solve(self):
+        """ Returns a bytearray of encoded results, one byte per index.
+        """
+        values = bytearray(self.size)
+        remaining = array("H", [0]) * self.size
+        succ_offsets = array("l", [0])
+        succ_indexes = array("l")
+        queue = deque()
+
+        for index in range(self.size):
+            position = decode_index(self.material, index)
+            if not position.is_valid():
+                values[index] = INVALID
+            else:
+                children = position.successors()
+                succ_indexes.extend(encode_position(child) for child in children)
+                remaining[index] = len(children)
+                if not children:
+                    values[index] = 1
+                    queue.append(index)
+            succ_offsets.append(len(succ_indexes))
+
+        pred_offsets = array("l", [0]) * (self.size + 1)
+        for child in succ_indexes:
+            pred_offsets[child + 1] += 1
+        for index in range(self.size):
+            pred_offsets[index + 1] += pred_offsets[index]
+
+        fill = array("l", pred_offsets)
+        pred_indexes = array("l", [0]) * len(succ_indexes)
+        for index in range(self.size):
+            for k in range(succ_offsets[index], succ_offsets[index + 1]):
+                child = succ_indexes[k]
+                pred_indexes[fill[child]] = index
+                fill[child] += 1
+
+        while queue:
+            index = queue.popleft()
+            distance = values[index] - 1
+            if distance >= MAX_DISTANCE:
+                continue
+
+            for k in range(pred_offsets[index], pred_offsets[index + 1]):
+                parent = pred_indexes[k]
+                if values[parent] != DRAW:
+                    continue
+                if distance % 2 == 0:
+                    values[parent] = distance + 2
+                    queue.append(parent)
+                else:
+                    remaining[parent] -= 1
+                    if remaining[parent] == 0:
+                        values[parent] = distance + 2
+                        queue.append(parent)
+
+        return values
+
+
+def decode_index(material, index):
+    stm, index = index % 2, index // 2
+    king_lower, index = index % NUM_SQUARES, index // NUM_SQUARES
+    king_upper, index = index % NUM_SQUARES, index // NUM_SQUARES
+
+    pieces = []
+    for _ in material:
+        state, index = index % NUM_PIECE_STATES, index // NUM_PIECE_STATES
+        location, state = state % NUM_LOCATIONS, state // NUM_LOCATIONS
+        pieces.append([state // 2, state % 2, location])
+
+    return Position(material, stm, [king_lower, king_upper], pieces)
+
+
+def encode_position(position):
+    index = 0
+    for owner, promoted, location in reversed(position.pieces):
+        index = index * NUM_PIECE_STATES + (owner * 2 + promoted) * NUM_LOCATIONS + location
+    index = (index * NUM_SQUARES + position.kings[1]) * NUM_SQUARES + position.kings[0]
+    return index * 2 + position.stm
+
+
+def position_from_board(board):
+    """ Returns the Position for a Board, or None if a king is missing.
+    """
+    kings = []
+    entries = []
+    for owner, name in enumerate(PLAYER_NAMES):
+        player = board.players[name]
+        if not player.king:
+            return None
+        kings.append(coords_to_square(player.king.coords))
+
+        for piece in player.pieces:
+            if type(piece) != King:
+                entries.append((piece._icon, [owner, int(piece.is_promoted), coords_to_square(piece.coords)]))
+        for piece in player.captures:
+            entries.append((piece._icon, [owner, 0, HAND]))
+
+    entries.sort()
+    material = "".join(letter for letter, _ in entries)
+    stm = PLAYER_NAMES.index(board.current_player.name)
+    return Position(material, stm, kings, [state for _, state in entries])
+
+
+class Tablebase:
+    """
+    Reads a tablebase file and answers probes in constant time.
+
+    Tables are decompressed the first time a position with their material
+    is probed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.directory = {}
+        self.tables = {}
+
+        with open(filename, "rb") as f:
+            magic, version, num_tables = struct.unpack("<4sHH", f.read(8))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{filename} is not a version {VERSION} tablebase file.")
+
+            for _ in range(num_tables):
+                length, = struct.unpack("<B", f.read(1))
+                material = f.read(length).decode("ascii")
+                self.directory[material] = struct.unpack("<QQ", f.read(16))
+
+    def get_table(self, material):
+        if material not in self.tables:
+            offset, length = self.directory[material]
+            with open(self.filename, "rb") as f:
+                f.seek(offset)
+                self.tables[material] = zlib.decompress(f.read(length))
+        return self.tables[material]
+
+    def probe(self, board):
+        """
+        Returns (result, distance) for the player to move on board, or None.
+
+        result is "win", "loss" or "draw" and distance is the number of plies
+        to mate with best play (0 for a draw). None means the material is not
+        in the tablebase or the position cannot occur.
+        """
+        position = position_from_board(board)
+        if position is None or position.material not in self.directory:
+            return None
+
+        value = self.get_table(position.material)[encode_position(position)]
+        if value == INVALID:
+            return None
+        if value == DRAW:
+            return ("draw", 0)
+
+        distance = value - 1
+        return ("win" if distance % 2 else "loss", distance)
+
+
+def write_tablebase(filename, tables):
+    """ Writes {material: values} to filename as a header, a directory and compressed tables.
+    """
+    blobs = {material: zlib.compress(bytes(values), 9) for material, values in tables.items()}
+    header_size = 8 + sum(1 + len(material) + 16 for material in blobs)
+
+    with open(filename, "wb") as f:
+        f.write(struct.pack("<4sHH", MAGIC, VERSION, len(blobs)))
+
+        offset = header_size
+        for material, blob in blobs.items():
+            f.write(struct.pack("<B", len(material)) + material.encode("ascii"))
+            f.write(struct.pack("<QQ", offset, len(blob)))
+            offset += len(blob)
+
+        for blob in blobs.values():
+            f.write(blob)
+
+
+MOVE_TABLES = init_move_tables()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("material", nargs="*", default=list(PIECE_LETTERS),
+                        help="non-king pieces of each table, e.g. R or GP (default: each single piece).")
+    parser.add_argument("-o", "--output", default="minishogi.tb", help="tablebase file to write.")
+    args = parser.parse_args()
+
+    tables = {}
+    for material in args.material:
+        generator = TablebaseGenerator(material)
+        tables[generator.material] = generator.solve()
+        print(f"Solved {generator.material}: {generator.size} positions.")
+
+    write_tablebase(args.output, tables)
@@ -25,6 +25,27 @@ def input_to_commands(user_input):
         return (command, True)
     return (command, False)
 
+def is_valid_command(user_input):
+    """ Returns whether user input is a well-formed move or drop command on the board.
+    """
+    split_input = user_input.split(" ")
+    if len(split_input) not in (3, 4) or (len(split_input) == 4 and split_input[3] != "promote"):
+        return False
+
+    if split_input[0] == "move":
+        positions = split_input[1:3]
+    elif split_input[0] == "drop" and len(split_input) == 3:
+        positions = split_input[2:3]
+    else:
+        return False
+
+    for pos in positions:
+        if len(pos) != 2 or not "a" <= pos[0] < chr(ord("a") + BOARD_SIZE):
+            return False
+        if not pos[1].isdigit() or not 1 <= int(pos[1]) <= BOARD_SIZE:
+            return False
+    return True
+
 def pos_to_coords(pos_1):
     """ Convert board position to grid coordinates
     """
@@ -77,17 +98,18 @@ def _stringify_square(sq):
         return sq + '|'
 
 
-def stringify_board(board):
-    s = ''
+def stringify_row(board, row):
+    squares = [_stringify_square(board[col][row]) for col in range(0, len(board[row]))]
+    return str(row + 1) + ' |' + ''.join(squares) + os.linesep
 
-    for row in range(len(board) - 1, -1, -1):
-        s += '' + str(row + 1) + ' |'
-        for col in range(0, len(board[row])):
-            s += _stringify_square(board[col][row])
-        s += os.linesep
-    s += '    ' + '  '.join([chr(ord('a') + i) for i in range(len(board))]) + os.linesep
 
-    return s
+def stringify_footer(size):
+    return '    ' + '  '.join([chr(ord('a') + i) for i in range(size)]) + os.linesep
+
+
+def stringify_board(board):
+    rows = [stringify_row(board, row) for row in range(len(board) - 1, -1, -1)]
+    return ''.join(rows) + stringify_footer(len(board))
 
 def parse_test_case(path):
     f = open(path)